@@ -1,4 +1,3 @@
-import csv
 import datetime
 import os
 import numpy as np
@@ -18,7 +17,18 @@ from htm.algorithms.anomaly_likelihood import \
     AnomalyLikelihood  # FIXME use TM.anomaly instead, but it gives worse results than the py.AnomalyLikelihood now
 from htm.bindings.algorithms import Predictor
 
-from htm.algorithms.anomaly import Anomaly
+verbosityLow = 0
+verbosityMedium = 1
+verbosityHigh = 2
+FILE_VERBOSITY = (
+    verbosityLow
+)  # change this to change printing verbosity of this file (per-step messages are verbosityHigh)
+
+
+def printLog(txt, verbosity=verbosityLow):
+    if FILE_VERBOSITY >= verbosity:
+        print(txt)
+
 
 _EXAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
 _INPUT_FILE_PATH = os.path.join(_EXAMPLE_DIR, "gymdata.csv")
@@ -53,32 +63,58 @@ default_parameters = {
             {  # 'learningPeriod': int(math.floor(self.probationaryPeriod / 2.0)),
                 # 'probationaryPeriod': self.probationaryPeriod-default_parameters["anomaly"]["likelihood"]["learningPeriod"],
                 'probationaryPct': 0.1,
-                'reestimationPeriod': 100}  # These settings are copied from NAB
+                'reestimationPeriod': 100,  # These settings are copied from NAB
+                'historicWindowSize': 8640}  # sliding window of scores kept for re-estimation (~1 month of 5min data)
     }
 }
 
 pandaServer = PandaServer()
 
+
+def sparseToBitset(sparse, size):
+    # packs SDR sparse indices into array of 64bit words (bit i is in word i>>6),
+    # duplicate indices are fine, they just set the same bit
+    bitset = np.zeros((size + 63) // 64, dtype=np.uint64)
+    sparse = np.asarray(sparse, dtype=np.uint64)
+    np.bitwise_or.at(bitset, sparse >> np.uint64(6), np.uint64(1) << (sparse & np.uint64(63)))
+    return bitset
+
+
+if hasattr(np, "bitwise_count"):  # numpy >= 2.0 has native popcount
+    def bitsetPopcount(bitset):
+        return int(np.bitwise_count(bitset).sum())
+else:
+    def bitsetPopcount(bitset):
+        return int(np.unpackbits(bitset.view(np.uint8)).sum())
+
+
+def calculateRawAnomaly(activeColumns, predictedColumns, columnCount):
+    # same as htm Anomaly.calculateRawAnomaly(), but works directly on sparse indices,
+    # so no intermediate SDRs are created. Fraction of active columns that were not predicted.
+    # Overlap is counted by popcount of AND of the two bitsets
+    if len(activeColumns) == 0:
+        return 0.0
+    overlap = bitsetPopcount(sparseToBitset(activeColumns, columnCount) & sparseToBitset(predictedColumns, columnCount))
+    return (len(activeColumns) - overlap) / len(activeColumns)
+
+
 def main(parameters=default_parameters, argv=None, verbose=True):
+    global serverData
+
     if verbose:
         import pprint
         print("Parameters:")
         pprint.pprint(parameters, indent=4)
         print("")
 
-    # Read the input file.
-    records = []
-    with open(_INPUT_FILE_PATH, "r") as fin:
-        reader = csv.reader(fin)
-        headers = next(reader)
-        next(reader)
-        next(reader)
-        for record in reader:
-            records.append(record)
+    # Read the input file and parse it at once, so the main loop only indexes into ready arrays.
+    # first three rows are header (names, types, flags)
+    records = np.loadtxt(_INPUT_FILE_PATH, delimiter=",", skiprows=3, dtype=str)
+    timestamps = [datetime.datetime.strptime(ts, "%m/%d/%y %H:%M") for ts in records[:, 0]]
+    consumptions = records[:, 1].astype(np.float32)
 
     # Make the Encoders.  These will convert input data into binary representations.
-    dateEncoder = DateEncoder(timeOfDay=parameters["enc"]["time"]["timeOfDay"],
-                              weekend=parameters["enc"]["time"]["weekend"])
+    dateEncoder = DateEncoder(**parameters["enc"]["time"])
 
     scalarEncoderParams = RDSE_Parameters()
     scalarEncoderParams.size = parameters["enc"]["value"]["size"]
@@ -128,36 +164,69 @@ def main(parameters=default_parameters, argv=None, verbose=True):
     learningPeriod = int(math.floor(probationaryPeriod / 2.0))
     anomaly_history = AnomalyLikelihood(learningPeriod=learningPeriod,
                                         estimationSamples=probationaryPeriod - learningPeriod,
-                                        reestimationPeriod=anParams["reestimationPeriod"])
+                                        reestimationPeriod=anParams["reestimationPeriod"],
+                                        historicWindowSize=anParams["historicWindowSize"])
+
+    # with spatial (totally novel, raw anomaly 1.0) input the likelihood is not computed, last value is kept,
+    # but the estimator still gets every N-th such a score, so it isn't starved
+    spatialAnomalyFeedPeriod = 10
+    anomalyLikelihood = 0.5  # neutral until estimator gives some value
 
     predictor = Predictor(steps=[1, 5], alpha=parameters["predictor"]['sdrc_alpha'])
     predictor_resolution = 1
 
     # Iterate through every datum in the dataset, record the inputs & outputs.
-    inputs = []
-    anomaly = []
-    anomalyProb = []
-    predictions = {1: [], 5: []}
-    for count, record in enumerate(records):
-
-        # Convert date string into Python date object.
-        dateString = datetime.datetime.strptime(record[0], "%m/%d/%y %H:%M")
-        # Convert data value string into float.
-        consumption = float(record[1])
-        inputs.append(consumption)
-
-        # Call the encoders to create bit representations for each value.  These are SDR objects.
-        dateBits = dateEncoder.encode(dateString)
-        consumptionBits = scalarEncoder.encode(consumption)
+    # outputs are preallocated for whole dataset, inputs are the already parsed consumptions
+    numRecords = len(consumptions)
+    inputs = consumptions
+    anomaly = np.empty(numRecords, np.float32)
+    anomalyProb = np.empty(numRecords, np.float32)
+    predictions = {1: np.full(numRecords, np.nan, np.float32), 5: np.full(numRecords, np.nan, np.float32)}
+
+    # SDRs reused every step (the compute methods below overwrite their content),
+    # so no new SDR has to be allocated per record.
+    encoding = SDR(encodingWidth)
+    # Active columns must have the same dimensions as the Spatial Pooler.
+    activeColumns = SDR(sp.getColumnDimensions())
+    # date bits are placed right after the consumption bits in the encoding
+    dateBitsOffset = scalarEncoder.size
+
+    # Call the encoders to create bit representations for each value.  Encoders are deterministic
+    # and all values are known upfront, so encode everything before the main loop (just copies of sparse indices are kept,
+    # the encoded SDRs are temporary).
+    # Many records repeat the same encoder input, so each distinct one is encoded just once:
+    # date encoding with just timeOfDay/weekend/dayOfWeek depends only on day of week and time of day,
+    # other settings (season, holiday, customDays...) are keyed by the whole timestamp, so nothing is shared wrongly.
+    # Consumption values have just one decimal and repeat a lot
+    dateKeyByTimeOfWeek = set(parameters["enc"]["time"]) <= {"timeOfDay", "weekend", "dayOfWeek"}
+    dateBitsCache = {}
+    consumptionBitsCache = {}
+    allDateBits = []
+    allConsumptionBits = []
+    for ts, val in zip(timestamps, consumptions):
+        dateKey = (ts.weekday(), ts.hour, ts.minute, ts.second) if dateKeyByTimeOfWeek else ts
+        if dateKey not in dateBitsCache:
+            dateBitsCache[dateKey] = dateEncoder.encode(ts).sparse.copy()
+        allDateBits.append(dateBitsCache[dateKey])
+
+        if val not in consumptionBitsCache:
+            consumptionBitsCache[val] = scalarEncoder.encode(val).sparse.copy()
+        allConsumptionBits.append(consumptionBitsCache[val])
+
+    # NOTE: SP and TM are intentionally driven step by step from python (not fused into one native call),
+    # the visualization needs the state between tm.activateDendrites() and tm.activateCells() and waits for client there
+    for count in range(numRecords):
+
+        consumption = consumptions[count]
+
+        dateBits = allDateBits[count]
+        consumptionBits = allConsumptionBits[count]
 
         # Concatenate all these encodings into one large encoding for Spatial Pooling.
-        encoding = SDR(encodingWidth).concatenate([consumptionBits, dateBits])
+        # Done directly on sparse indices, so no dense buffer is created
+        encoding.sparse = np.concatenate((consumptionBits, dateBits + dateBitsOffset))
         enc_info.addData(encoding)
 
-        # Create an SDR to represent active columns, This will be populated by the
-        # compute method below. It must have the same dimensions as the Spatial Pooler.
-        activeColumns = SDR(sp.getColumnDimensions())
-
         # Execute Spatial Pooling algorithm over input space.
         sp.compute(encoding, True, activeColumns)
         sp_info.addData(activeColumns)
@@ -166,59 +235,67 @@ def main(parameters=default_parameters, argv=None, verbose=True):
         # tm.compute(activeColumns, learn=True)
         tm.activateDendrites(True)
         predictiveCellsSDR = tm.getPredictiveCells()
+        winnerCellsSDR = tm.getWinnerCells()
 
         # ------------------HTMpandaVis----------------------
 
-        # fill up values
-        serverData.HTMObjects["HTM1"].inputs["SL_Consumption"].stringValue = "consumption: {:.2f}".format(consumption)
-        serverData.HTMObjects["HTM1"].inputs["SL_Consumption"].bits = consumptionBits.sparse
-        serverData.HTMObjects["HTM1"].inputs["SL_Consumption"].count = consumptionBits.size
+        # fill up values, just if there is some client to show them. First step is always published,
+        # so a client that connects later has complete data to build the scene from
+        if pandaServer.HasClient() or not pandaServer.stateDataPublished:
+            serverData.HTMObjects["HTM1"].inputs["SL_Consumption"].stringValue = "consumption: {:.2f}".format(consumption)
+            serverData.HTMObjects["HTM1"].inputs["SL_Consumption"].bits = consumptionBits
+            serverData.HTMObjects["HTM1"].inputs["SL_Consumption"].count = scalarEncoder.size
 
-        serverData.HTMObjects["HTM1"].inputs["SL_TimeOfDay"].stringValue = record[0]
-        serverData.HTMObjects["HTM1"].inputs["SL_TimeOfDay"].bits = dateBits.sparse
-        serverData.HTMObjects["HTM1"].inputs["SL_TimeOfDay"].count = dateBits.size
+            serverData.HTMObjects["HTM1"].inputs["SL_TimeOfDay"].stringValue = records[count, 0]
+            serverData.HTMObjects["HTM1"].inputs["SL_TimeOfDay"].bits = dateBits
+            serverData.HTMObjects["HTM1"].inputs["SL_TimeOfDay"].count = dateEncoder.size
 
-        serverData.HTMObjects["HTM1"].layers["SensoryLayer"].activeColumns = activeColumns.sparse
-        serverData.HTMObjects["HTM1"].layers["SensoryLayer"].winnerCells = tm.getWinnerCells().sparse
-        serverData.HTMObjects["HTM1"].layers["SensoryLayer"].predictiveCells = predictiveCellsSDR.sparse
+            # copies - activeColumns SDR is reused and overwritten by sp.compute() next step,
+            # while the published buffer can still be pickled by the server thread
+            serverData.HTMObjects["HTM1"].layers["SensoryLayer"].activeColumns = activeColumns.sparse.copy()
+            serverData.HTMObjects["HTM1"].layers["SensoryLayer"].winnerCells = winnerCellsSDR.sparse.copy()
+            serverData.HTMObjects["HTM1"].layers["SensoryLayer"].predictiveCells = predictiveCellsSDR.sparse.copy()
 
-        pandaServer.serverData = serverData
+            # hand over filled data to the server, get back the other buffer to be filled next step
+            serverData = pandaServer.PublishStateData(serverData)
+            if serverData is None:  # first publish, server had no buffer to give back yet
+                serverData = CreateServerData()
 
         pandaServer.spatialPoolers["HTM1"] = sp
         pandaServer.temporalMemories["HTM1"] = tm
-        pandaServer.NewStateDataReady()
 
-        print("One step finished")
-        while not pandaServer.runInLoop and not pandaServer.runOneStep:
-            pass
-        pandaServer.runOneStep = False
-        print("Proceeding one step...")
+        printLog("One step finished", verbosityHigh)
+        pandaServer.WaitForStep()
+        printLog("Proceeding one step...", verbosityHigh)
 
         # ------------------HTMpandaVis----------------------
 
         tm.activateCells(activeColumns, True)
 
-        tm_info.addData(tm.getActiveCells().flatten())
-
+        # query active cells just once per step, they don't change until next activateCells()
         activeCells = tm.getActiveCells()
-        print("ACTIVE" + str(len(activeCells.sparse)))
+        tm_info.addData(activeCells.flatten())
+
+        printLog("ACTIVE" + str(len(activeCells.sparse)), verbosityHigh)
 
         # Predict what will happen, and then train the predictor based on what just happened.
-        pdf = predictor.infer(tm.getActiveCells())
+        pdf = predictor.infer(activeCells)
         for n in (1, 5):
             if pdf[n]:
-                predictions[n].append(np.argmax(pdf[n]) * predictor_resolution)
-            else:
-                predictions[n].append(float('nan'))
+                predictions[n][count] = np.argmax(pdf[n]) * predictor_resolution
+            # else stays NaN
 
-        rawAnomaly = Anomaly.calculateRawAnomaly(activeColumns,
-                                                 tm.cellsToColumns(predictiveCellsSDR))
-        print("aaa" + str(rawAnomaly))
-        anomalyLikelihood = anomaly_history.anomalyProbability(consumption, rawAnomaly) # need to use different calculation as we are not calling sp.compute(..)
-        anomaly.append(rawAnomaly)
-        anomalyProb.append(anomalyLikelihood)
+        # predictive cells -> columns, same as tm.cellsToColumns() but without creating SDR
+        predictedColumns = predictiveCellsSDR.sparse // tmParams["cellsPerColumn"]
+        rawAnomaly = calculateRawAnomaly(activeColumns.sparse, predictedColumns, spParams["columnCount"])
+        printLog("aaa" + str(rawAnomaly), verbosityHigh)
+        isSpatialAnomaly = rawAnomaly >= 1.0 - 1e-9
+        if not isSpatialAnomaly or count < probationaryPeriod or count % spatialAnomalyFeedPeriod == 0:
+            anomalyLikelihood = anomaly_history.anomalyProbability(consumption, rawAnomaly) # need to use different calculation as we are not calling sp.compute(..)
+        anomaly[count] = rawAnomaly
+        anomalyProb[count] = anomalyLikelihood
 
-        predictor.learn(count, tm.getActiveCells(), int(consumption / predictor_resolution))
+        predictor.learn(count, activeCells, int(consumption / predictor_resolution))
 
     # Print information & statistics about the state of the HTM.
     print("Encoded Input", enc_info)
@@ -231,23 +308,19 @@ def main(parameters=default_parameters, argv=None, verbose=True):
     print("")
 
     # Shift the predictions so that they are aligned with the input they predict.
-    for n_steps, pred_list in predictions.items():
-        for x in range(n_steps):
-            pred_list.insert(0, float('nan'))
-            pred_list.pop()
+    for n_steps in predictions:
+        pred = predictions[n_steps]
+        predictions[n_steps] = np.concatenate([np.full(n_steps, np.nan, np.float32), pred[:-n_steps]])
 
     # Calculate the predictive accuracy, Root-Mean-Squared
     accuracy = {1: 0, 5: 0}
-    accuracy_samples = {1: 0, 5: 0}
-
-    for idx, inp in enumerate(inputs):
-        for n in predictions:  # For each [N]umber of time steps ahead which was predicted.
-            val = predictions[n][idx]
-            if not math.isnan(val):
-                accuracy[n] += (inp - val) ** 2
-                accuracy_samples[n] += 1
-    for n in sorted(predictions):
-        accuracy[n] = (accuracy[n] / accuracy_samples[n]) ** .5
+
+    inp = np.asarray(inputs, dtype=np.float64)
+    for n in sorted(predictions):  # For each [N]umber of time steps ahead which was predicted.
+        pred = predictions[n]
+        mask = ~np.isnan(pred)
+        diff = inp[mask] - pred[mask]
+        accuracy[n] = np.sqrt(np.mean(diff * diff))
         print("Predictive Error (RMS)", n, "steps ahead:", accuracy[n])
 
     # Show info about the anomaly (mean & std)
@@ -262,22 +335,26 @@ def main(parameters=default_parameters, argv=None, verbose=True):
             print("WARNING: failed to import matplotlib, plots cannot be shown.")
             return -accuracy[5]
 
+        # plot at most ~5000 points, matplotlib rendering gets slow for long runs
+        stride = max(1, int(np.ceil(len(inputs) / 5000)))
+        x = np.arange(0, len(inputs), stride)
+
         plt.subplot(2, 1, 1)
         plt.title("Predictions")
         plt.xlabel("Time")
         plt.ylabel("Power Consumption")
-        plt.plot(np.arange(len(inputs)), inputs, 'red',
-                 np.arange(len(inputs)), predictions[1], 'blue',
-                 np.arange(len(inputs)), predictions[5], 'green', )
+        plt.plot(x, inputs[::stride], 'red',
+                 x, predictions[1][::stride], 'blue',
+                 x, predictions[5][::stride], 'green', )
         plt.legend(labels=('Input', '1 Step Prediction, Shifted 1 step', '5 Step Prediction, Shifted 5 steps'))
 
         plt.subplot(2, 1, 2)
         plt.title("Anomaly Score")
         plt.xlabel("Time")
         plt.ylabel("Power Consumption")
-        inputs = np.array(inputs) / max(inputs)
-        plt.plot(np.arange(len(inputs)), inputs, 'red',
-                 np.arange(len(inputs)), anomaly, 'blue', )
+        inputs = inputs / np.max(inputs)
+        plt.plot(x, inputs[::stride], 'red',
+                 x, anomaly[::stride], 'blue', )
         plt.legend(labels=('Input', 'Anomaly Score'))
         plt.show()
 
@@ -286,6 +363,11 @@ def main(parameters=default_parameters, argv=None, verbose=True):
 
 def BuildPandaSystem():
     global serverData
+    serverData = CreateServerData()
+    # second buffer is created after the first PublishStateData(), these two are then swapped each step
+
+
+def CreateServerData():
     serverData = ServerData()
     serverData.HTMObjects["HTM1"] = dataHTMObject()
     serverData.HTMObjects["HTM1"].inputs["SL_Consumption"] = dataInput()
@@ -300,6 +382,8 @@ def BuildPandaSystem():
         "SL_TimeOfDay",
     ]
 
+    return serverData
+
 
 if __name__ == "__main__":
     try:
@@ -58,11 +58,16 @@ def recv_one_message(sock):
 
 class PandaServer:
     def __init__(self):
-        self.serverData = ServerData()
+        self.serverData = ServerData()  # data that are sent to the client, see PublishStateData()
+        self.stateDataPublished = False  # until first publish, serverData is just empty placeholder
+        self.serverDataLock = threading.Lock()
         self.runOneStep = False
         self.runInLoop = False
+        # guards runOneStep & runInLoop, main thread waits on it for RUN or STEP, see WaitForStep()
+        self.stepCondition = threading.Condition()
         self.newStateDataReadyForVis = False
         self.mainThreadQuitted = False
+        self.clientConnected = False
 
         self.serverThread = ServerThread(self, 1, "ServerThread-1")
 
@@ -76,8 +81,28 @@ class PandaServer:
         self.mainThreadQuitted = True
         self.serverThread.join()
 
-    def NewStateDataReady(self):
-        self.newStateDataReadyForVis = True
+    def HasClient(self):  # no need to prepare data for vis if nobody listens
+        return self.clientConnected
+
+    def WaitForStep(self):
+        # blocks main thread until client sends RUN or STEP, no busy waiting.
+        # Waits with timeout, so KeyboardInterrupt can be raised in between (on Windows too)
+        with self.stepCondition:
+            while not self.runInLoop and not self.runOneStep:
+                self.stepCondition.wait(0.1)
+            self.runOneStep = False
+
+    def PublishStateData(self, serverData):
+        # double buffering - filled serverData become the data sent to the client,
+        # the previously sent instance is returned to be filled in the next step.
+        # So the main thread never writes into data that are being pickled by the server thread.
+        # Returns None for the first call - the initial placeholder is not a buffer to be filled
+        with self.serverDataLock:
+            previousData = self.serverData if self.stateDataPublished else None
+            self.serverData = serverData
+            self.stateDataPublished = True
+            self.newStateDataReadyForVis = True
+        return previousData
 
     def RunServer(self):
         HOST = "localhost"
@@ -93,19 +118,20 @@ class PandaServer:
 
         printLog("Server listening")
 
-        clientConnected = False
+        self.clientConnected = False
 
-        while not clientConnected and not self.mainThreadQuitted:
+        while not self.clientConnected and not self.mainThreadQuitted:
             try:
                 conn, addr = s.accept()
                 conn.settimeout(5)
                 printLog("Connected by" + str(addr))
-                clientConnected = True
-                self.newStateDataReadyForVis = True
+                self.clientConnected = True
+                # nothing to send until main thread publishes first step, see PublishStateData()
+                self.newStateDataReadyForVis = self.stateDataPublished
             except socket.timeout:
                 continue
 
-            if not clientConnected:
+            if not self.clientConnected:
                 printLog("Client is not connected anymore")
                 return
 
@@ -121,12 +147,11 @@ class PandaServer:
                     if rxData[0] == CLIENT_CMD.CMD_GET_STATE_DATA:
                         printLog("State data requested", verbosityHigh)
                         if self.newStateDataReadyForVis:
-                        
-                            send_one_message(
-                                conn, PackData(SERVER_CMD.SEND_STATE_DATA, self.serverData)
-                            )
+                            with self.serverDataLock:
+                                rawData = PackData(SERVER_CMD.SEND_STATE_DATA, self.serverData)
+                                self.newStateDataReadyForVis = False
 
-                            self.newStateDataReadyForVis = False
+                            send_one_message(conn, rawData)
                         else:
                             send_one_message(
                                 conn, PackData(SERVER_CMD.NA, [])
@@ -157,23 +182,24 @@ class PandaServer:
                         )
                         sp.getConnectedSynapses(requestedCol, connectedSynapses)
 
-                        self.serverData.HTMObjects[HTMObjectName].layers[
-                            layerName
-                        ].proximalSynapses = [[requestedCol, connectedSynapses]]
+                        with self.serverDataLock:
+                            self.serverData.HTMObjects[HTMObjectName].layers[
+                                layerName
+                            ].proximalSynapses = [[requestedCol, connectedSynapses]]
+
+                            printLog(
+                                "Sending:"
+                                + str(
+                                    self.serverData.HTMObjects[HTMObjectName]
+                                    .layers[layerName]
+                                    .proximalSynapses
+                                ),
+                                verbosityHigh,
+                            )
 
-                        printLog(
-                            "Sending:"
-                            + str(
-                                self.serverData.HTMObjects[HTMObjectName]
-                                .layers[layerName]
-                                .proximalSynapses
-                            ),
-                            verbosityHigh,
-                        )
-                            
-                        send_one_message(
-                            conn, PackData(SERVER_CMD.SEND_PROXIMAL_DATA, self.serverData)
-                        )
+                            rawData = PackData(SERVER_CMD.SEND_PROXIMAL_DATA, self.serverData)
+
+                        send_one_message(conn, rawData)
 
                         printLog(
                             "Sent synapses of len:" + str(len(connectedSynapses)),
@@ -203,23 +229,29 @@ class PandaServer:
                         #winners = tm.getWinnerCells()
                         
                         #print(winners)
-                        self.serverData.HTMObjects[HTMObjectName].layers[
-                            layerName
-                        ].distalSynapses = [[requestedColumn,requestedCell,presynCells]]#sending just one pack for one cell
-                        send_one_message(
-                            conn, PackData(SERVER_CMD.SEND_DISTAL_DATA, self.serverData)
-                        )
+                        with self.serverDataLock:
+                            self.serverData.HTMObjects[HTMObjectName].layers[
+                                layerName
+                            ].distalSynapses = [[requestedColumn,requestedCell,presynCells]]#sending just one pack for one cell
+                            rawData = PackData(SERVER_CMD.SEND_DISTAL_DATA, self.serverData)
+
+                        send_one_message(conn, rawData)
                         
                         # TODO predictive cells
                         
                     elif rxData[0] == CLIENT_CMD.CMD_RUN:
-                        self.runInLoop = True
+                        with self.stepCondition:
+                            self.runInLoop = True
+                            self.stepCondition.notify_all()
                         printLog("RUN", verbosityHigh)
                     elif rxData[0] == CLIENT_CMD.CMD_STOP:
-                        self.runInLoop = False
+                        with self.stepCondition:
+                            self.runInLoop = False
                         printLog("STOP", verbosityHigh)
                     elif rxData[0] == CLIENT_CMD.CMD_STEP_FWD:
-                        self.runOneStep = True
+                        with self.stepCondition:
+                            self.runOneStep = True
+                            self.stepCondition.notify_all()
                         printLog("STEP", verbosityHigh)
                     elif rxData[0] == CLIENT_CMD.QUIT:
                         printLog("Client quitted!")
@@ -227,7 +259,7 @@ class PandaServer:
                 except struct.error as e:
                     printLog("StructError:")
                     printLog(e)
-                    clientConnected = False
+                    self.clientConnected = False
                     break
                 except socket.timeout:
                     printLog("SocketTimeout")
@@ -235,11 +267,11 @@ class PandaServer:
                 except SocketError as e:
                     printLog("SocketError")
                     printLog(e)
-                    clientConnected = False
+                    self.clientConnected = False
                     break
                 except EOFError:
                     printLog("EOFError")
-                    clientConnected = False
+                    self.clientConnected = False
                     break
                 # except Exception as e:
                 #    printLog("Exception" + str(sys.exc_info()[0]))
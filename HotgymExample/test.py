@@ -276,24 +276,18 @@ def main(parameters=default_parameters, argv=None, verbose=True):
     print("")
 
     # Shift the predictions so that they are aligned with the input they predict.
-    for n_steps, pred_list in predictions.items():
-        for x in range(n_steps):
-            pred_list.insert(0, float("nan"))
-            pred_list.pop()
+    for n_steps in predictions:
+        pred = np.asarray(predictions[n_steps], dtype=np.float64)
+        predictions[n_steps] = np.concatenate([np.full(n_steps, np.nan), pred[:-n_steps]])
 
     # Calculate the predictive accuracy, Root-Mean-Squared
     accuracy = {1: 0, 5: 0}
-    accuracy_samples = {1: 0, 5: 0}
-    for idx, inp in enumerate(inputs):
-        for (
-            n
-        ) in predictions:  # For each [N]umber of time steps ahead which was predicted.
-            val = predictions[n][idx]
-            if not math.isnan(val):
-                accuracy[n] += (inp - val) ** 2
-                accuracy_samples[n] += 1
-    for n in sorted(predictions):
-        accuracy[n] = (accuracy[n] / accuracy_samples[n]) ** 0.5
+    inp = np.asarray(inputs, dtype=np.float64)
+    for n in sorted(predictions):  # For each [N]umber of time steps ahead which was predicted.
+        pred = predictions[n]
+        mask = ~np.isnan(pred)  # one vectorized NaN check, no per element math.isnan()
+        diff = inp[mask] - pred[mask]
+        accuracy[n] = np.sqrt(np.mean(diff * diff))
         print("Predictive Error (RMS)", n, "steps ahead:", accuracy[n])
 
     # Show info about the anomaly (mean & std)
@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 from panda3d.core import CollisionTraverser, CollisionNode
-from panda3d.core import CollisionHandlerQueue, CollisionRay
+from panda3d.core import CollisionHandlerQueue, CollisionRay, BitMask32
+from objects.cell import COLLISION_MASK_CELL
+from objects.minicolumn import COLLISION_MASK_COLUMN
 
 
 verbosityLow = 0
@@ -34,47 +36,50 @@ class cInteraction:
     def UpdateCameraMovement(self):
         deltaT = globalClock.getDt()
 
-        speed = self.base.speed
+        base = self.base
+        camera = base.camera
+        keys = self.keys
+
+        speed = base.speed
 
         if self.speedBoost:
             speed *= 4
 
         """Rotation with mouse while right-click"""
-        mw = self.base.mouseWatcherNode
+        mw = base.mouseWatcherNode
         deltaX = 0
         deltaY = 0
 
-        if mw.hasMouse() and self.base.rotateCamera:
-            deltaX = mw.getMouseX() - self.mouseX_last
-            deltaY = mw.getMouseY() - self.mouseY_last
+        if mw.hasMouse() and base.rotateCamera:
+            mouseX = mw.getMouseX()
+            mouseY = mw.getMouseY()
+            deltaX = mouseX - self.mouseX_last
+            deltaY = mouseY - self.mouseY_last
 
-            self.mouseX_last = mw.getMouseX()
-            self.mouseY_last = mw.getMouseY()
+            self.mouseX_last = mouseX
+            self.mouseY_last = mouseY
 
         if deltaT > 0.05:
             # FPS are low, limit deltaT
             deltaT = 0.05
 
-        move_x = deltaT * speed * -self.keys["a"] + deltaT * speed * self.keys["d"]
-        move_y = deltaT * speed * self.keys["s"] + deltaT * speed * -self.keys["w"]
-        self.base.move_z += (
-            deltaT * speed * self.keys["shift"] + deltaT * speed * -self.keys["control"]
-        )
+        step = deltaT * speed
+        move_x = step * (keys["d"] - keys["a"])
+        move_y = step * (keys["s"] - keys["w"])
+        base.move_z += step * (keys["shift"] - keys["control"])
 
-        self.base.camera.setPos(self.base.camera, move_x, -move_y, 0)
-        self.base.camera.setZ(self.base.move_z)
+        camera.setPos(camera, move_x, -move_y, 0)
+        camera.setZ(base.move_z)
 
-        self.base.camHeading += (
-            deltaT * 90 * self.keys["arrow_left"]
-            + deltaT * 90 * -self.keys["arrow_right"]
+        base.camHeading += (
+            deltaT * 90 * (keys["arrow_left"] - keys["arrow_right"])
             + deltaT * 5000 * -deltaX
         )
-        self.base.camPitch += (
-            deltaT * 90 * self.keys["arrow_up"]
-            + deltaT * 90 * -self.keys["arrow_down"]
+        base.camPitch += (
+            deltaT * 90 * (keys["arrow_up"] - keys["arrow_down"])
             + deltaT * 5000 * deltaY
         )
-        self.base.camera.setHpr(self.base.camHeading, self.base.camPitch, 0)
+        camera.setHpr(base.camHeading, base.camPitch, 0)
         
     def SetupKeys(self):
         # Setup controls
@@ -110,16 +115,16 @@ class cInteraction:
         if self.base.win.isClosed():
             self.CloseApp()
 
-        width = self.base.win.getProperties().getXSize()
-        height = self.base.win.getProperties().getYSize()
+        props = self.base.win.getProperties()
+        width, height = props.getXSize(), props.getYSize()
 
+        # lens is owned by the cam, so no need to set it back by setLens()
         lens = self.base.cam.node().getLens()
         lens.setFov(60)
         lens.setAspectRatio(width / height)
 
         # lens.setFilmSize(width,height)
         # lens.setFocalLength(self.FOCAL_LENGTH)
-        self.base.cam.node().setLens(lens)
 
 
     def onKey(self, key, value):
@@ -143,9 +148,10 @@ class cInteraction:
         if event == "right":
             self.base.rotateCamera = press
 
-            if self.base.mouseWatcherNode.hasMouse():
-                self.mouseX_last = self.base.mouseWatcherNode.getMouseX()
-                self.mouseY_last = self.base.mouseWatcherNode.getMouseY()
+            mw = self.base.mouseWatcherNode
+            if mw.hasMouse():
+                self.mouseX_last = mw.getMouseX()
+                self.mouseY_last = mw.getMouseY()
             else:
                 self.mouseX_last = 0
                 self.mouseY_last = 0
@@ -159,19 +165,35 @@ class cInteraction:
             
     def onClickObject(self):
         mpos = self.base.mouseWatcherNode.getMouse()
-        self.pickerRay.setFromLens(self.base.camNode, mpos.getX(), mpos.getY())
+        mx, my = mpos.getX(), mpos.getY()
+        self.pickerRay.setFromLens(self.base.camNode, mx, my)
 
+        # coarse traversal - cells are not tested here, just the bounding spheres of columns
         self.myTraverser.traverse(self.render)
         # assume for simplicity's sake that myHandler is a CollisionHandlerQueue
         if self.myHandler.getNumEntries() > 0:
             # get closest object
             self.myHandler.sortEntries()
-
-            pickedObj = self.myHandler.getEntry(0).getIntoNodePath()
-            # printLog("----------- "+str(self.myHandler.getNumEntries()))
-            print(self.myHandler.getEntries())
+            printLog(self.myHandler.getEntries(), verbosityHigh)
+
+            pickedObj = None
+            for entry in self.myHandler.getEntries():
+                intoNodePath = entry.getIntoNodePath()
+                if intoNodePath.getName() != "columnSphere":
+                    pickedObj = intoNodePath
+                    break
+
+                # fine traversal - only cells of the column that was hit
+                self.cellTraverser.traverse(intoNodePath.getParent())
+                if self.cellHandler.getNumEntries() > 0:
+                    self.cellHandler.sortEntries()
+                    pickedObj = self.cellHandler.getEntry(0).getIntoNodePath()
+                    break
+
+            if pickedObj is None:
+                return
             pickedObj = pickedObj.findNetTag("clickable")
-            print(pickedObj)
+            printLog(pickedObj, verbosityHigh)
             if not pickedObj.isEmpty() and self.base.allHTMobjectsCreated:
                 self.HandlePickedObject(pickedObj)
 
@@ -181,8 +203,9 @@ class cInteraction:
         pickerNode = CollisionNode("mouseRay")
         pickerNP = self.base.camera.attachNewNode(pickerNode)
         pickerNode.setFromCollideMask(
-            CollisionNode.getDefaultCollideMask()
+            CollisionNode.getDefaultCollideMask() | COLLISION_MASK_COLUMN
         )  # GeomNode.getDefaultCollideMask())
+        pickerNode.setIntoCollideMask(BitMask32.allOff())
         self.pickerRay = CollisionRay()
         pickerNode.addSolid(self.pickerRay)
 
@@ -194,6 +217,17 @@ class cInteraction:
 
         self.myTraverser.addCollider(pickerNP, self.myHandler)
 
+        # second ray (same solid) that collides just with cells, see onClickObject()
+        cellPickerNode = CollisionNode("mouseRayCells")
+        cellPickerNP = self.base.camera.attachNewNode(cellPickerNode)
+        cellPickerNode.setFromCollideMask(COLLISION_MASK_CELL)
+        cellPickerNode.setIntoCollideMask(BitMask32.allOff())
+        cellPickerNode.addSolid(self.pickerRay)
+
+        self.cellTraverser = CollisionTraverser("mouseCellsCollisionTraverser")
+        self.cellHandler = CollisionHandlerQueue()
+        self.cellTraverser.addCollider(cellPickerNP, self.cellHandler)
+
     def CloseApp(self):
 
         printLog("CLOSE app event")
@@ -5,7 +5,7 @@ Created on Wed Feb  6 05:46:38 2019
 
 @author: osboxes
 """
-from panda3d.core import LColor, CollisionBox, CollisionNode
+from panda3d.core import LColor, CollisionBox, CollisionNode, NodePath, BitMask32
 from panda3d.core import (
     GeomVertexFormat,
     GeomVertexData,
@@ -14,7 +14,6 @@ from panda3d.core import (
     GeomLines,
     GeomNode,
 )
-import random
 from Colors import *
 
 verbosityLow = 0
@@ -22,11 +21,17 @@ verbosityMedium = 1
 verbosityHigh = 2
 FILE_VERBOSITY = verbosityHigh  # change this to change printing verbosity of this file
 
+# cells are not collided by the default mask, they are picked just inside of a column
+# that was hit before (see cInteraction.onClickObject)
+COLLISION_MASK_CELL = BitMask32.bit(22)
+
 def printLog(txt, verbosity=verbosityLow):
     if FILE_VERBOSITY >= verbosity:
         print(txt)
         
 class cCell:
+    cubeModel = None  # model is loaded just once, each cell gets its own copy of it
+
     def __init__(self, column):
         self.active = False
         self.predictive = False
@@ -41,7 +46,11 @@ class cCell:
         self, loader, idx
     ):  # idx is neccesary to be able to track it down for mouse picking
 
-        self.__node = loader.loadModel("models/cube")
+        if cCell.cubeModel is None:
+            cCell.cubeModel = loader.loadModel("models/cube")
+
+        # own copy is needed (not instance), because every cell has its own color and tag
+        self.__node = NodePath(cCell.cubeModel.node().copySubgraph())
         self.__node.setPos(0, 0, 0)
         self.__node.setScale(0.5, 0.5, 0.5)
         self.__node.setTag("clickable", str(idx))  # to be able to click on it
@@ -51,8 +60,10 @@ class cCell:
         collBox = CollisionBox(self.__node.getPos(), 1.0, 1.0, 1.0)
         cnodePath = self.__node.attachNewNode(CollisionNode("cnode"))
         cnodePath.node().addSolid(collBox)
+        cnodePath.node().setIntoCollideMask(COLLISION_MASK_CELL)
 
-        self.UpdateState(False, False)
+        # initial (inactive) color is not set here per cell, but once for all cells of the column
+        # by the parent node, see cMinicolumn.CreateGfx(). Cells override it by UpdateState()
 
     def UpdateState(self, active, predictive, focused=False, presynapticFocus=False, newStep = False):
 
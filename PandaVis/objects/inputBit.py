@@ -6,12 +6,14 @@ Created on Sat Feb 23 11:37:36 2019
 @author: zz
 """
 
-from panda3d.core import LColor, CollisionNode, CollisionBox
+from panda3d.core import LColor, CollisionNode, CollisionBox, NodePath
 from Colors import *
 # import random
 
 
 class cInputBit:
+    cubeModel = None  # model is loaded just once, each input bit gets its own copy of it
+
     def __init__(self, parentObj):
         self.__parentObj = parentObj
         self.active = False  # False if random.randint(0,1)==0 else True
@@ -23,7 +25,11 @@ class cInputBit:
 
     def CreateGfx(self, loader, idx):
 
-        self.__node = loader.loadModel("models/cube")
+        if cInputBit.cubeModel is None:
+            cInputBit.cubeModel = loader.loadModel("models/cube")
+
+        # own copy is needed (not instance), because every bit has its own color and tag
+        self.__node = NodePath(cInputBit.cubeModel.node().copySubgraph())
         #self.__node.setRenderModeFilledWireframe(LColor(0, 0, 0, 1.0))
         self.__node.setPos(0, 0, 0)
         self.__node.setScale(0.5, 0.5, 0.5)
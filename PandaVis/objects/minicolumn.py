@@ -3,6 +3,7 @@
 
 from objects.cell import cCell
 from panda3d.core import NodePath, PandaNode, LODNode, LColor
+from panda3d.core import CollisionNode, CollisionSphere, BitMask32
 from panda3d.core import (
     GeomVertexFormat,
     GeomVertexData,
@@ -20,6 +21,9 @@ FILE_VERBOSITY = verbosityHigh  # change this to change printing verbosity of th
 
 CELL_OFFSET = 0.3
 
+# bounding sphere of the whole column, used for coarse mouse picking
+COLLISION_MASK_COLUMN = BitMask32.bit(21)
+
 def printLog(txt, verbosity=verbosityLow):
     if FILE_VERBOSITY >= verbosity:
         print(txt)
@@ -90,6 +94,18 @@ class cMinicolumn:
             z += 1+CELL_OFFSET
             n.getNode().reparentTo(self.__cellsNodePath)
 
+        # bulk color for all newly created (inactive) cells, instead of setting it for each cell separately
+        self.__cellsNodePath.setColor(COL_CELL_INACTIVE)
+
+        # COLLISION - one sphere around all cells, so mouse picking tests
+        # cells only of the column that was hit
+        if len(self.cells) > 0:
+            halfHeight = (len(self.cells) - 1) * (1 + CELL_OFFSET) / 2
+            collSphere = CollisionSphere(0, 0, halfHeight, halfHeight + 1.0)
+            cnodePath = self.__cellsNodePath.attachNewNode(CollisionNode("columnSphere"))
+            cnodePath.node().addSolid(collSphere)
+            cnodePath.node().setIntoCollideMask(COLLISION_MASK_COLUMN)
+
         self.gfxCreated = True
 
     def LODUpdateSwitch(self, lodDistance, lodDistance2):